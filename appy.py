@@ -1,34 +1,108 @@
 import streamlit as st
-import pandas as pd
 import difflib
 import re
-from html import escape
+from bisect import bisect_left
+from collections import Counter
 from io import BytesIO
-from docx import Document
+from diff_match_patch import diff_match_patch
+from rapidfuzz.distance import Levenshtein
+
+STATUS_LABELS = {
+    "Same": "동일",
+    "Modified": "일부 수정",
+    "Added": "신설",
+    "Deleted": "삭제"
+}
+
+# Paragraph pairs up to this length are diffed character by character;
+# longer pairs are diffed as sequences of word ids
+SHORT_DIFF_MAX_CHARS = 500
+
+WORD_RE = re.compile(r'\s+|\S+')
+
+# Anchor splitting can give up a longer match than it keeps, so only documents
+# past roughly 1000 x 1000 paragraphs trade the exact matcher for it
+ANCHOR_SPLIT_MIN_CELLS = 1_000_000
+
+TAG_RE = re.compile(r'<.*?>')
+
+# Same replacements as html.escape(quote=True), applied in a single pass
+HTML_ESCAPE_TABLE = str.maketrans({
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    '"': "&quot;",
+    "'": "&#x27;"
+})
 
 # ---------- Helper Functions ----------
 
+@st.cache_resource(show_spinner=False)
+def get_document_class():
+    # python-docx pulls in lxml; only import it once a document is needed
+    from docx import Document
+    return Document
+
+def levenshtein_diffs(a, b):
+    diffs = []
+    for tag, i1, i2, j1, j2 in Levenshtein.opcodes(a, b):
+        if tag == "equal":
+            diffs.append((diff_match_patch.DIFF_EQUAL, a[i1:i2]))
+            continue
+        if i1 < i2:
+            diffs.append((diff_match_patch.DIFF_DELETE, a[i1:i2]))
+        if j1 < j2:
+            diffs.append((diff_match_patch.DIFF_INSERT, b[j1:j2]))
+    return diffs
+
+def word_diffs(a, b):
+    a_words = WORD_RE.findall(a)
+    b_words = WORD_RE.findall(b)
+    word_ids = {}
+    a_ids = [word_ids.setdefault(w, len(word_ids)) for w in a_words]
+    b_ids = [word_ids.setdefault(w, len(word_ids)) for w in b_words]
+
+    diffs = []
+    for tag, i1, i2, j1, j2 in Levenshtein.opcodes(a_ids, b_ids):
+        if tag == "equal":
+            diffs.append((diff_match_patch.DIFF_EQUAL, "".join(a_words[i1:i2])))
+            continue
+        if i1 < i2:
+            diffs.append((diff_match_patch.DIFF_DELETE, "".join(a_words[i1:i2])))
+        if j1 < j2:
+            diffs.append((diff_match_patch.DIFF_INSERT, "".join(b_words[j1:j2])))
+    return diffs
+
 def highlight_differences(a, b):
-    a_words = a.split()
-    b_words = b.split()
-    matcher = difflib.SequenceMatcher(None, a_words, b_words)
-    
+    if a == b:
+        return a.translate(HTML_ESCAPE_TABLE), b.translate(HTML_ESCAPE_TABLE)
+
+    if len(a) <= SHORT_DIFF_MAX_CHARS and len(b) <= SHORT_DIFF_MAX_CHARS:
+        diffs = levenshtein_diffs(a, b)
+    else:
+        diffs = word_diffs(a, b)
+    # rapidfuzz reports each edit as its own op; merge adjacent ones first
+    dmp = diff_match_patch()
+    dmp.diff_cleanupMerge(diffs)
+    dmp.diff_cleanupSemantic(diffs)
+
     a_out = []
     b_out = []
 
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-        if tag == "equal":
-            a_out.extend([escape(word) for word in a_words[i1:i2]])
-            b_out.extend([escape(word) for word in b_words[j1:j2]])
-        elif tag in ("replace", "delete"):
-            a_out.extend([f"<u>{escape(word)}</u>" for word in a_words[i1:i2]])
-        if tag in ("replace", "insert"):
-            b_out.extend([f"<u>{escape(word)}</u>" for word in b_words[j1:j2]])
+    for op, text in diffs:
+        text = text.translate(HTML_ESCAPE_TABLE)
+        if op == diff_match_patch.DIFF_EQUAL:
+            a_out.append(text)
+            b_out.append(text)
+        elif op == diff_match_patch.DIFF_DELETE:
+            a_out.append(f"<u>{text}</u>")
+        elif op == diff_match_patch.DIFF_INSERT:
+            b_out.append(f"<u>{text}</u>")
 
-    return " ".join(a_out), " ".join(b_out)
+    return "".join(a_out), "".join(b_out)
 
 def render_html_table(results):
-    table_html = """
+    parts = ["""
     <style>
     table {
         width: 100%;
@@ -71,24 +145,34 @@ def render_html_table(results):
             </tr>
         </thead>
         <tbody>
-    """
-
-    for row in results:
-        status_class = row['Status'].lower()
-        table_html += (
-            f"<tr class='{status_class}'>"
-            f"<td><b>{translate_status(row['Status'])}</b></td>"
-            f"<td>{row['Original']}</td>"
-            f"<td>{row['Revised']}</td>"
+    """]
+    append = parts.append
+    label = STATUS_LABELS.get
+
+    for status, original, revised in zip(results['Status'], results['Original'], results['Revised']):
+        append(
+            f"<tr class='{status.lower()}'>"
+            f"<td><b>{label(status, status)}</b></td>"
+            f"<td>{original}</td>"
+            f"<td>{revised}</td>"
             f"</tr>"
         )
 
-    table_html += "</tbody></table>"
-    return table_html
-
-def extract_paragraphs(file):
-    doc = Document(file)
-    return [p.text.strip() for p in doc.paragraphs if p.text.strip()]
+    append("</tbody></table>")
+    return "".join(parts)
+
+# Both uploads of a pair go through here, so keep room for four recent pairs
+@st.cache_data(show_spinner=False, max_entries=8)
+def extract_paragraphs(file_bytes):
+    Document = get_document_class()
+    doc = Document(BytesIO(file_bytes))
+    paragraphs = []
+    append = paragraphs.append
+    for p in doc.paragraphs:
+        text = p.text.strip()
+        if text:
+            append(text)
+    return paragraphs
 
 def classify_diff(old, new, threshold=0.9):
     if old == new:
@@ -97,25 +181,94 @@ def classify_diff(old, new, threshold=0.9):
         return "Deleted", old, "<Deleted>"
     elif not old:
         return "Added", "<New>", new
+    elif len(old) > 2000 and len(new) > 2000:
+        return "Modified", old, new
     else:
-        ratio = difflib.SequenceMatcher(None, old, new).ratio()
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+            return "Modified", old, new
+        ratio = matcher.ratio()
         if ratio >= threshold:
             return "Modified", old, new
         else:
             return "Modified", old, new
 
+def unique_anchors(a, b):
+    counts_a = Counter(a)
+    counts_b = Counter(b)
+    index_b = {x: j for j, x in enumerate(b) if counts_b[x] == 1}
+    candidates = [
+        (i, index_b[x]) for i, x in enumerate(a)
+        if counts_a[x] == 1 and x in index_b
+    ]
+
+    # Longest run of candidates that is increasing in both documents
+    tails = []
+    tail_indices = []
+    previous = [None] * len(candidates)
+    for k, (_, j) in enumerate(candidates):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_indices.append(k)
+        else:
+            tails[pos] = j
+            tail_indices[pos] = k
+        previous[k] = tail_indices[pos - 1] if pos else None
+
+    anchors = []
+    k = tail_indices[-1] if tail_indices else None
+    while k is not None:
+        anchors.append(candidates[k])
+        k = previous[k]
+    anchors.reverse()
+    return anchors
+
+def paragraph_opcodes(a, b):
+    if len(a) * len(b) <= ANCHOR_SPLIT_MIN_CELLS:
+        return difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+
+    opcodes = []
+    a_start = b_start = 0
+
+    for a_end, b_end in unique_anchors(a, b) + [(len(a), len(b))]:
+        if a_start < a_end or b_start < b_end:
+            sm = difflib.SequenceMatcher(None, a[a_start:a_end], b[b_start:b_end], autojunk=False)
+            for tag, i1, i2, j1, j2 in sm.get_opcodes():
+                opcodes.append((tag, i1 + a_start, i2 + a_start, j1 + b_start, j2 + b_start))
+        if a_end < len(a):
+            opcodes.append(("equal", a_end, a_end + 1, b_end, b_end + 1))
+        a_start, b_start = a_end + 1, b_end + 1
+
+    return opcodes
+
+@st.cache_data(show_spinner=False, max_entries=4)
 def compare_documents(original_paras, revised_paras):
-    sm = difflib.SequenceMatcher(None, original_paras, revised_paras)
-    result = []
+    if original_paras == revised_paras:
+        return {
+            "Status": ["Same"] * len(original_paras),
+            "Original": list(original_paras),
+            "Revised": list(revised_paras)
+        }
+
+    # Match on small integer ids instead of the paragraph strings themselves
+    pool = {}
+
+    def intern(para):
+        return pool.setdefault(para.strip(), len(pool))
+
+    original_ids = [intern(p) for p in original_paras]
+    revised_ids = [intern(p) for p in revised_paras]
+
+    statuses = []
+    originals = []
+    reviseds = []
 
-    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+    for tag, i1, i2, j1, j2 in paragraph_opcodes(original_ids, revised_ids):
         if tag == "equal":
-            for i, j in zip(range(i1, i2), range(j1, j2)):
-                result.append({
-                    "Status": "Same",
-                    "Original": original_paras[i],
-                    "Revised": revised_paras[j]
-                })
+            statuses.extend(["Same"] * (i2 - i1))
+            originals.extend(original_paras[i1:i2])
+            reviseds.extend(revised_paras[j1:j2])
 
         elif tag == "replace":
             len1 = i2 - i1
@@ -125,55 +278,43 @@ def compare_documents(original_paras, revised_paras):
                 orig_raw = original_paras[i1 + k]
                 rev_raw = revised_paras[j1 + k]
 
-                if orig_raw.strip() == rev_raw.strip():
-                    result.append({
-                        "Status": "Same",
-                        "Original": escape(orig_raw),
-                        "Revised": escape(rev_raw)
-                    })
+                if original_ids[i1 + k] == revised_ids[j1 + k]:
+                    statuses.append("Same")
+                    originals.append(orig_raw.translate(HTML_ESCAPE_TABLE))
+                    reviseds.append(rev_raw.translate(HTML_ESCAPE_TABLE))
                 else:
                     orig_diff, rev_diff = highlight_differences(orig_raw, rev_raw)
-                    result.append({
-                        "Status": "Modified",
-                        "Original": orig_diff,
-                        "Revised": rev_diff
-                    })
-
-            for k in range(min_len, len1):
-                result.append({
-                    "Status": "Deleted",
-                    "Original": original_paras[i1 + k],
-                    "Revised": "<Deleted>"
-                })
-            for k in range(min_len, len2):
-                result.append({
-                    "Status": "Added",
-                    "Original": "<New>",
-                    "Revised": revised_paras[j1 + k]
-                })
+                    statuses.append("Modified")
+                    originals.append(orig_diff)
+                    reviseds.append(rev_diff)
+
+            statuses.extend(["Deleted"] * (len1 - min_len))
+            originals.extend(original_paras[i1 + min_len:i2])
+            reviseds.extend(["<Deleted>"] * (len1 - min_len))
+
+            statuses.extend(["Added"] * (len2 - min_len))
+            originals.extend(["<New>"] * (len2 - min_len))
+            reviseds.extend(revised_paras[j1 + min_len:j2])
 
         elif tag == "delete":
-            for i in range(i1, i2):
-                result.append({
-                    "Status": "Deleted",
-                    "Original": original_paras[i],
-                    "Revised": "<Deleted>"
-                })
+            statuses.extend(["Deleted"] * (i2 - i1))
+            originals.extend(original_paras[i1:i2])
+            reviseds.extend(["<Deleted>"] * (i2 - i1))
 
         elif tag == "insert":
-            for j in range(j1, j2):
-                result.append({
-                    "Status": "Added",
-                    "Original": "<New>",
-                    "Revised": revised_paras[j]
-                })
+            statuses.extend(["Added"] * (j2 - j1))
+            originals.extend(["<New>"] * (j2 - j1))
+            reviseds.extend(revised_paras[j1:j2])
 
-    return result
+    return {"Status": statuses, "Original": originals, "Revised": reviseds}
 
 def strip_tags(text):
-    return re.sub(r'<.*?>', '', text)
+    if "<" not in text:
+        return text
+    return TAG_RE.sub('', text)
 
 def create_docx_report(results):
+    Document = get_document_class()
     doc = Document()
     doc.add_heading("변경 대비표 (수정/신설/삭제 항목)", level=1)
 
@@ -184,23 +325,20 @@ def create_docx_report(results):
     hdr_cells[1].text = '기존 문구'
     hdr_cells[2].text = '개정 문구'
 
-    for row in results:
-        if row['Status'] == "Same":
+    for status, original, revised in zip(results['Status'], results['Original'], results['Revised']):
+        if status == "Same":
             continue
         row_cells = table.add_row().cells
-        row_cells[0].text = translate_status(row['Status'])
-        row_cells[1].text = strip_tags(row['Original'])
-        row_cells[2].text = strip_tags(row['Revised'])
+        row_cells[0].text = translate_status(status)
+        row_cells[1].text = strip_tags(original)
+        row_cells[2].text = strip_tags(revised)
 
-    return doc
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
 
 def translate_status(status):
-    return {
-        "Same": "동일",
-        "Modified": "일부 수정",
-        "Added": "신설",
-        "Deleted": "삭제"
-    }.get(status, status)
+    return STATUS_LABELS.get(status, status)
 
 # ---------- Streamlit UI ----------
 
@@ -221,33 +359,40 @@ with col2:
     file2 = st.file_uploader("📝 개정 문서 업로드 (.docx)", type="docx")
 
 if file1 and file2:
-    with st.spinner("문단을 분석 중입니다..."):
-        original_paragraphs = extract_paragraphs(file1)
-        revised_paragraphs = extract_paragraphs(file2)
+    upload_key = (file1.file_id, file2.file_id)
 
-    st.success("✅ 문단 추출 완료!")
-    st.write(f"📄 기존 문서 문단 수: {len(original_paragraphs)}")
-    st.write(f"📝 개정 문서 문단 수: {len(revised_paragraphs)}")
+    if st.session_state.get("comparison_key") != upload_key:
+        with st.spinner("문단을 분석 중입니다..."):
+            original_paragraphs = extract_paragraphs(file1.getvalue())
+            revised_paragraphs = extract_paragraphs(file2.getvalue())
+
+        comparison_results = compare_documents(original_paragraphs, revised_paragraphs)
+        has_changes = any(status != "Same" for status in comparison_results['Status'])
 
-    comparison_results = compare_documents(original_paragraphs, revised_paragraphs)
+        st.session_state["comparison_key"] = upload_key
+        st.session_state["comparison"] = {
+            "original_count": len(original_paragraphs),
+            "revised_count": len(revised_paragraphs),
+            "table_html": render_html_table(comparison_results),
+            "docx_bytes": create_docx_report(comparison_results) if has_changes else None
+        }
+
+    comparison = st.session_state["comparison"]
+
+    st.success("✅ 문단 추출 완료!")
+    st.write(f"📄 기존 문서 문단 수: {comparison['original_count']}")
+    st.write(f"📝 개정 문서 문단 수: {comparison['revised_count']}")
 
     st.subheader("📊 변경 대비표 (수정된 부분은 밑줄로 강조됨)")
-    st.components.v1.html(render_html_table(comparison_results), height=800, scrolling=True)
+    st.components.v1.html(comparison["table_html"], height=800, scrolling=True)
 
     # ---- DOCX Export ----
     st.markdown("### 📥 변경 문단 Word 파일로 다운로드")
 
-    filtered_results = [row for row in comparison_results if row['Status'] != "Same"]
-
-    if filtered_results:
-        docx_file = create_docx_report(filtered_results)
-        buffer = BytesIO()
-        docx_file.save(buffer)
-        buffer.seek(0)
-
+    if comparison["docx_bytes"] is not None:
         st.download_button(
             label="DOCX 파일 다운로드",
-            data=buffer,
+            data=comparison["docx_bytes"],
             file_name="변경_대비표.docx",
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
@@ -255,6 +400,3 @@ if file1 and file2:
         st.info("변경된 문장이 없습니다. Word 파일이 생성되지 않았습니다.")
 else:
     st.warning("두 문서를 모두 업로드해주세요.")
-
-
-